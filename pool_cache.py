@@ -0,0 +1,128 @@
+"""
+Uniswap v3 池子信息缓存
+
+多个示例脚本都会查询同一个池子的基本信息（当前tick、价格、流动性、代币信息）。
+该模块把查询结果以JSON文件的形式缓存在本地，在有效期内重复运行只需要池子信息的脚本时，
+可以省去重复的subgraph查询。
+
+范围和头寸示例只共用其中的查询片段：它们本来就要查询tick或头寸数据，
+池子信息随第一个请求一并查询，使用缓存不会减少请求，反而可能使池子信息比其他数据更旧。
+
+功能：
+- 读取和保存缓存的池子信息
+- 缓存未命中时通过urllib查询subgraph并写入缓存
+
+注意：缓存的池子信息最多过期CACHE_TTL秒，适用于示例脚本，不适用于需要实时数据的场景
+"""
+
+import json
+import os
+import time
+import urllib.request
+
+# Uniswap v3 subgraph的URL
+URL = "https://api.thegraph.com/subgraphs/name/uniswap/uniswap-v3"
+
+# 缓存目录（相对于当前工作目录）
+CACHE_DIR = ".pool_cache"
+# 缓存有效期（秒）
+CACHE_TTL = 60
+
+# GraphQL查询片段：池子的基本信息
+# 需要一并查询其他数据的脚本可以把该片段嵌入自己的查询中
+pool_fields = """  pools(where: {id: $pool_id}) {
+    tick
+    sqrtPrice
+    liquidity
+    feeTier
+    token0 {
+      symbol
+      decimals
+    }
+    token1 {
+      symbol
+      decimals
+    }
+  }"""
+
+# GraphQL查询：获取池子的基本信息
+pool_query = "query get_pools($pool_id: ID!) {\n" + pool_fields + "\n}"
+
+
+def cache_path(pool_id):
+    """
+    返回池子信息缓存文件的路径
+
+    参数:
+        pool_id: 池子ID
+
+    返回:
+        缓存文件路径
+    """
+    return os.path.join(CACHE_DIR, "{}.json".format(pool_id.lower()))
+
+def load_pool(pool_id):
+    """
+    读取缓存的池子信息
+
+    参数:
+        pool_id: 池子ID
+
+    返回:
+        池子信息；如果没有缓存、缓存已过期或缓存文件格式不正确，返回None
+    """
+    try:
+        with open(cache_path(pool_id)) as f:
+            entry = json.load(f)
+        # 格式不正确的缓存文件（例如被手动修改过）与缓存未命中一样处理
+        pool = entry["pool"]
+        if time.time() - entry["time"] > CACHE_TTL or not isinstance(pool, dict):
+            return None
+        return pool
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def store_pool(pool_id, pool):
+    """
+    保存池子信息到缓存
+
+    写入失败（例如目录不可写）时静默忽略，缓存只是一种优化。
+
+    参数:
+        pool_id: 池子ID
+        pool: 池子信息，即subgraph返回的pools查询结果中的一项
+    """
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(cache_path(pool_id), "w") as f:
+            json.dump({"time": time.time(), "pool": pool}, f)
+    except OSError:
+        pass
+
+def get_pool(pool_id):
+    """
+    获取池子信息，优先使用缓存
+
+    参数:
+        pool_id: 池子ID
+
+    返回:
+        池子信息；如果池子不存在，返回None
+    """
+    pool = load_pool(pool_id)
+    if pool is not None:
+        return pool
+
+    # 查询subgraph
+    req = urllib.request.Request(URL)
+    req.add_header('Content-Type', 'application/json; charset=utf-8')
+    jsondata = {"query": pool_query, "variables": {"pool_id": pool_id}}
+    jsondataasbytes = json.dumps(jsondata).encode('utf-8')
+    req.add_header('Content-Length', len(jsondataasbytes))
+    response = urllib.request.urlopen(req, jsondataasbytes)
+    pools = json.load(response)['data']['pools']
+
+    if len(pools) == 0:
+        return None
+    store_pool(pool_id, pools[0])
+    return pools[0]
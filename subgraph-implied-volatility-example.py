@@ -30,6 +30,10 @@ POOL_ID = "0x8ad599c3a0ff1de082011efddc58f1908eb6e6d8"
 if len(sys.argv) > 1:
     POOL_ID = sys.argv[1]
 
+# 价格平方根的指数系数：ln(1.0001) / 2，即 √P = exp(HALF_LN_TICK_BASE * tick)
+# 使用log1p(0.0001)计算，避免1.0001本身的舍入误差随tick放大
+HALF_LN_TICK_BASE = 0.5 * math.log1p(0.0001)
+
 # 查询的天数
 NUM_DAYS = 5
 
@@ -49,17 +53,19 @@ pool_query = """query get_pools($pool_id: ID!, $num_days: Int) {
   }
 }"""
 
-def tick_to_price(tick):
+def tick_to_sqrt_price(tick):
     """
-    将tick索引转换为价格
-    
+    将tick索引转换为价格的平方根
+
     参数:
         tick: tick索引
-    
+
     返回:
-        价格
+        价格的平方根 √P
+
+    公式: √P = 1.0001 ^ (tick / 2) = exp(tick * ln(1.0001) / 2)
     """
-    return 1.0001 ** tick
+    return math.exp(HALF_LN_TICK_BASE * tick)
 
 def fee_tier_to_tick_spacing(fee_tier):
     """
@@ -115,8 +121,8 @@ bottom_tick = current_tick // tick_spacing * tick_spacing
 top_tick = bottom_tick + tick_spacing
 
 # 计算价格平方根
-sa = tick_to_price(bottom_tick // 2)  # 底部tick的√P
-sb = tick_to_price(top_tick // 2)     # 顶部tick的√P
+sa = tick_to_sqrt_price(bottom_tick)  # 底部tick的√P
+sb = tick_to_sqrt_price(top_tick)     # 顶部tick的√P
 
 # 假设所有头寸都是USDC形式，计算锁定的USDC数量
 # 使用公式：amount = L * (√P_b - √P_a) / (√P_a * √P_b)
@@ -139,11 +145,14 @@ fee = fee_tier / (100 * 100)
 # - 费率反映了流动性提供者对风险的补偿要求
 # - √365 将日波动率年化
 # - 系数2来自期权定价理论
+#
+# 除交易量外的各项在循环中都不变，预先合并为一个系数：IV = k * √volume
+k = 2 * fee * math.sqrt(365) / math.sqrt(usd_amount_locked)
 for day_data in volumes[::-1]:  # 反转顺序，从旧到新显示
     volume_usd = float(day_data["volumeUSD"])  # 当日交易量(USD)
     
     # 计算隐含波动率
-    iv = 2 * fee * math.sqrt(volume_usd / usd_amount_locked) * math.sqrt(365)
+    iv = k * math.sqrt(volume_usd)
     
     # 转换时间戳为可读日期
     dt = datetime.fromtimestamp(int(day_data["date"]))
@@ -13,7 +13,11 @@ Uniswap v3 所有活跃流动性头寸示例
 """
 
 from gql import gql, Client
-from gql.transport.requests import RequestsHTTPTransport
+from gql.transport.aiohttp import AIOHTTPTransport
+from pool_cache import pool_fields
+from functools import lru_cache
+from operator import itemgetter
+import asyncio
 import math
 import sys
 
@@ -24,36 +28,29 @@ POOL_ID = "0x8ad599c3a0ff1de082011efddc58f1908eb6e6d8"
 if len(sys.argv) > 1:
     POOL_ID = sys.argv[1]
 
+# Uniswap v3 subgraph的URL
+URL = 'https://api.thegraph.com/subgraphs/name/uniswap/uniswap-v3'
+
 # Tick基数
 TICK_BASE = 1.0001
 
-# GraphQL查询：获取池子信息
-pool_query = """query get_pools($pool_id: ID!) {
-  pools(where: {id: $pool_id}) {
-    tick
-    sqrtPrice
-    liquidity
-    feeTier
-    token0 {
-      symbol
-      decimals
-    }
-    token1 {
-      symbol
-      decimals
-    }
-  }
-}"""
-
-# GraphQL查询：仅返回开放的头寸（流动性 > 0）
-position_query = """query get_positions($num_skip: Int, $pool_id: ID!) {
-  positions(skip: $num_skip, where: {pool: $pool_id, liquidity_gt: 0}) {
+# 价格平方根的指数系数：ln(1.0001) / 2，即 √P = exp(HALF_LN_TICK_BASE * tick)
+# 使用log1p(0.0001)计算，避免1.0001本身的舍入误差随tick放大
+HALF_LN_TICK_BASE = 0.5 * math.log1p(0.0001)
+
+# 每个头寸分页的大小（subgraph允许的最大值）
+PAGE_SIZE = 1000
+
+# GraphQL查询片段：按头寸ID升序获取一页头寸信息，仅返回开放的头寸（流动性 > 0）
+# 使用上一页最后一个头寸ID作为游标（keyset分页），而不是skip：
+# subgraph处理skip时需要扫描并丢弃前面的所有结果，而且skip的最大值是受限的
+position_page_fields = """  positions(first: $page_size, orderBy: id, orderDirection: asc,
+            where: {pool: $pool_id, liquidity_gt: 0, id_gt: $last_id}) {
     id
     tickLower { tickIdx }
     tickUpper { tickIdx }
     liquidity
-  }
-}"""
+  }"""
 
 
 def tick_to_price(tick):
@@ -68,110 +65,186 @@ def tick_to_price(tick):
     """
     return TICK_BASE ** tick
 
-# 创建GraphQL客户端
-client = Client(
-    transport=RequestsHTTPTransport(
-        url='https://api.thegraph.com/subgraphs/name/uniswap/uniswap-v3',
-        verify=True,
-        retries=5,
-    ))
+@lru_cache(maxsize=None)
+def tick_to_sqrt_price(tick):
+    """
+    将tick索引转换为价格的平方根，并缓存结果
 
-# 获取池子信息
-try:
-    variables = {"pool_id": POOL_ID}
-    response = client.execute(gql(pool_query), variable_values=variables)
-
-    if len(response['pools']) == 0:
-        print("pool not found")
-        exit(-1)
-
-    pool = response['pools'][0]
-    pool_liquidity = int(pool["liquidity"])  # 池子的总流动性
-    current_tick = int(pool["tick"])  # 当前价格对应的tick
-
-    # 获取代币信息
-    token0 = pool["token0"]["symbol"]
-    token1 = pool["token1"]["symbol"]
-    decimals0 = int(pool["token0"]["decimals"])
-    decimals1 = int(pool["token1"]["decimals"])
-except Exception as ex:
-    print("got exception while querying pool data:", ex)
-    exit(-1)
+    许多头寸共享相同的范围边界tick，缓存可以避免重复的指数运算。
 
-# 获取所有头寸信息
-positions = []  # 存储所有头寸的列表
-num_skip = 0    # 分页查询的偏移量
+    参数:
+        tick: tick索引
+
+    返回:
+        价格的平方根 √P
+    """
+    return math.exp(HALF_LN_TICK_BASE * tick)
+
+def make_position_query(include_pool):
+    """
+    构建获取一页头寸数据的GraphQL查询
+
+    参数:
+        include_pool: 是否在同一请求中一并查询池子信息
+
+    返回:
+        GraphQL查询字符串
+    """
+    parts = [pool_fields] if include_pool else []
+    parts.append(position_page_fields)
+    return ("query get_positions($pool_id: ID!, $page_size: Int!, $last_id: ID!) {\n"
+            + "\n".join(parts) + "\n}")
+
+def sum_position_amounts(positions, current_tick, current_sqrt_price):
+    """
+    累计所有头寸在当前价格下的代币数量
+
+    计算放在函数中完成，循环中的变量都是局部变量，比模块级的全局变量访问更快。
+
+    参数:
+        positions: (tick_lower, tick_upper, liquidity, id)元组的列表
+        current_tick: 当前价格对应的tick
+        current_sqrt_price: 当前价格的平方根
+
+    返回:
+        (total_amount0, total_amount1, active_liquidity, active_positions)，
+        其中active_positions是活跃头寸(id, tick_lower, tick_upper, amount0, amount1)元组的列表
+    """
+    active_liquidity = 0  # 活跃头寸的总流动性
+    total_amount0 = 0     # token0的总数量
+    total_amount1 = 0     # token1的总数量
+    active_positions = []
+
+    for tick_lower, tick_upper, liquidity, id in positions:
+
+        # 计算价格范围边界的平方根
+        sa = tick_to_sqrt_price(tick_lower)  # √P_a
+        sb = tick_to_sqrt_price(tick_upper)  # √P_b
+
+        if tick_upper <= current_tick:
+            # 当前价格高于头寸范围：只有token1被锁定
+            amount1 = liquidity * (sb - sa)
+            total_amount1 += amount1
+
+        elif tick_lower < current_tick < tick_upper:
+            # 当前价格在头寸范围内：两种代币都存在（活跃头寸）
+            amount0 = liquidity * (sb - current_sqrt_price) / (current_sqrt_price * sb)
+            amount1 = liquidity * (current_sqrt_price - sa)
+
+            total_amount0 += amount0
+            total_amount1 += amount1
+            active_liquidity += liquidity  # 累加活跃流动性
+            active_positions.append((id, tick_lower, tick_upper, amount0, amount1))
+        else:
+            # 当前价格低于头寸范围：只有token0被锁定
+            amount0 = liquidity * (sb - sa) / (sa * sb)
+            total_amount0 += amount0
+
+    return total_amount0, total_amount1, active_liquidity, active_positions
+
+# 预先解析两种查询（是否一并查询池子信息），分页时不必为每一页重新解析查询字符串
+position_query_with_pool = gql(make_position_query(include_pool=True))
+position_query = gql(make_position_query(include_pool=False))
+
+async def query_pool_and_positions():
+    """
+    查询池子信息和池子中所有开放的头寸
+
+    按头寸ID升序逐页查询，直到某一页不满为止。
+    池子信息随第一个请求一并查询，与第一页数据来自同一时刻的快照。
+
+    返回:
+        (pool, positions)，其中positions是(tick_lower, tick_upper, liquidity, id)元组的列表
+    """
+    # 池子信息随第一个请求一并查询；不使用缓存，以免当前tick和流动性比头寸数据更旧
+    pool = None
+    positions = []  # 存储所有头寸的列表
+    last_id = ""    # 分页游标：上一页最后一个头寸ID（ID按字符串排序）
+
+    # 创建GraphQL客户端
+    # 所有请求复用同一个HTTP会话；reconnecting=True时失败的请求会自动重试
+    client = Client(transport=AIOHTTPTransport(url=URL))
+    session = await client.connect_async(reconnecting=True)
+    try:
+        while True:
+            print("Querying positions, last_id=\"{}\"".format(last_id))
+            variables = {"pool_id": POOL_ID, "page_size": PAGE_SIZE, "last_id": last_id}
+            query = position_query_with_pool if pool is None else position_query
+            response = await session.execute(query, variable_values=variables)
+
+            if pool is None:
+                if len(response['pools']) == 0:
+                    print("pool not found")
+                    exit(-1)
+                pool = response['pools'][0]
+
+            # 提取头寸数据并存储
+            page = response["positions"]
+            # subgraph以字符串形式返回数值字段，需要转换为整数
+            # 每个头寸为(价格下限tick, 价格上限tick, 流动性, 头寸ID)
+            positions.extend(
+                (int(item["tickLower"]["tickIdx"]), int(item["tickUpper"]["tickIdx"]),
+                 int(item["liquidity"]), int(item["id"]))
+                for item in page)
+
+            # 如果这一页不满，说明已经没有更多结果
+            if len(page) < PAGE_SIZE:
+                return pool, positions
+
+            # 更新游标，准备下一次查询
+            last_id = page[-1]["id"]
+    finally:
+        await client.close_async()
+
+
+# 获取池子信息和所有头寸信息
 try:
-    while True:
-        print("Querying positions, num_skip={}".format(num_skip))
-        variables = {"num_skip": num_skip, "pool_id": POOL_ID}
-        response = client.execute(gql(position_query), variable_values=variables)
-
-        # 如果没有更多结果，退出循环
-        if len(response["positions"]) == 0:
-            break
-        
-        # 更新偏移量
-        num_skip += len(response["positions"])
-        
-        # 提取头寸数据并存储
-        for item in response["positions"]:
-            tick_lower = int(item["tickLower"]["tickIdx"])  # 价格下限tick
-            tick_upper = int(item["tickUpper"]["tickIdx"])  # 价格上限tick
-            liquidity = int(item["liquidity"])              # 流动性
-            id = int(item["id"])                            # 头寸ID
-            positions.append((tick_lower, tick_upper, liquidity, id))
+    pool, positions = asyncio.run(query_pool_and_positions())
 except Exception as ex:
-    print("got exception while querying position data:", ex)
+    print("got exception while querying pool and position data:", ex)
     exit(-1)
 
+pool_liquidity = int(pool["liquidity"])  # 池子的总流动性
+current_tick = int(pool["tick"])  # 当前价格对应的tick
+
+# 获取代币信息
+token0 = pool["token0"]["symbol"]
+token1 = pool["token1"]["symbol"]
+decimals0 = int(pool["token0"]["decimals"])
+decimals1 = int(pool["token1"]["decimals"])
+
+# 将原始数量和价格调整为人类可读格式（考虑小数位数）所用的系数
+# 只计算一次，之后用乘法代替每次的幂运算和除法
+inv_scale0 = 10.0 ** -decimals0
+inv_scale1 = 10.0 ** -decimals1
+inv_price_scale = 10.0 ** (decimals0 - decimals1)
+
 # 计算并打印当前价格
 current_price = tick_to_price(current_tick)
-current_sqrt_price = tick_to_price(current_tick / 2)  # 当前价格的平方根
-adjusted_current_price = current_price / (10 ** (decimals1 - decimals0))
+current_sqrt_price = tick_to_sqrt_price(current_tick)  # 当前价格的平方根
+adjusted_current_price = current_price * inv_price_scale
 print("Current price={:.6f} {} for {} at tick {}".format(adjusted_current_price, token1, token0, current_tick))
 
 
 # 累计所有活跃流动性和池中的总资产数量
-active_positions_liquidity = 0  # 活跃头寸的总流动性
-total_amount0 = 0               # token0的总数量
-total_amount1 = 0               # token1的总数量
+# 累加的结果与头寸的顺序无关，因此不需要对所有头寸排序
+total_amount0, total_amount1, active_positions_liquidity, active_positions = sum_position_amounts(
+    positions, current_tick, current_sqrt_price)
+
+# 只对需要打印的活跃头寸按价格范围（以及头寸ID）排序
+active_positions.sort(key=itemgetter(1, 2, 0))
 
 # 打印所有活跃头寸
-for tick_lower, tick_upper, liquidity, id in sorted(positions):
-
-    # 计算价格范围边界的平方根
-    sa = tick_to_price(tick_lower / 2)  # √P_a
-    sb = tick_to_price(tick_upper / 2)  # √P_b
-
-    if tick_upper <= current_tick:
-        # 当前价格高于头寸范围：只有token1被锁定
-        amount1 = liquidity * (sb - sa)
-        total_amount1 += amount1
-
-    elif tick_lower < current_tick < tick_upper:
-        # 当前价格在头寸范围内：两种代币都存在（活跃头寸）
-        amount0 = liquidity * (sb - current_sqrt_price) / (current_sqrt_price * sb)
-        amount1 = liquidity * (current_sqrt_price - sa)
-        adjusted_amount0 = amount0 / (10 ** decimals0)
-        adjusted_amount1 = amount1 / (10 ** decimals1)
-
-        total_amount0 += amount0
-        total_amount1 += amount1
-        active_positions_liquidity += liquidity  # 累加活跃流动性
-
-        # 打印活跃头寸的详细信息
-        print("  position {: 7d} in range [{},{}]: {:.2f} {} and {:.2f} {} at the current price".format(
-              id, tick_lower, tick_upper,
-              adjusted_amount0, token0, adjusted_amount1, token1))
-    else:
-        # 当前价格低于头寸范围：只有token0被锁定
-        amount0 = liquidity * (sb - sa) / (sa * sb)
-        total_amount0 += amount0
+for id, tick_lower, tick_upper, amount0, amount1 in active_positions:
+    adjusted_amount0 = amount0 * inv_scale0
+    adjusted_amount1 = amount1 * inv_scale1
+    print("  position {: 7d} in range [{},{}]: {:.2f} {} and {:.2f} {} at the current price".format(
+          id, tick_lower, tick_upper,
+          adjusted_amount0, token0, adjusted_amount1, token1))
 
 
 # 打印统计信息
 print("In total (including inactive positions): {:.2f} {} and {:.2f} {}".format(
-      total_amount0 / 10 ** decimals0, token0, total_amount1 / 10 ** decimals1, token1))
+      total_amount0 * inv_scale0, token0, total_amount1 * inv_scale1, token1))
 print("Total liquidity from active positions: {}, from pool: {} (should be equal)".format(
       active_positions_liquidity, pool_liquidity))
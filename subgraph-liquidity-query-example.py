@@ -11,11 +11,10 @@ Uniswap v3 流动性查询示例
 - 计算当前tick范围内的资产数量
 - 显示可读格式的价格和资产余额
 
-注意：该脚本使用urllib而不是gql库进行HTTP请求
+注意：该脚本通过pool_cache模块使用urllib而不是gql库进行HTTP请求
 """
 
-import json
-import urllib.request
+from pool_cache import get_pool
 import math
 import sys
 
@@ -26,27 +25,12 @@ POOL_ID = '0x8ad599c3a0ff1de082011efddc58f1908eb6e6d8'
 if len(sys.argv) > 1:
     POOL_ID = sys.argv[1]
 
-# Uniswap v3 subgraph的URL
-URL = "https://api.thegraph.com/subgraphs/name/uniswap/uniswap-v3"
 # Tick基数
 TICK_BASE = 1.0001
 
-# GraphQL查询：获取池子信息
-query = """query pools($pool_id: ID!) {
-  pools (where: {id: $pool_id}) {
-    tick
-    liquidity
-    feeTier
-    token0 {
-      symbol
-      decimals
-    }
-    token1 {
-      symbol
-      decimals
-    }
-  }
-}"""
+# 价格平方根的指数系数：ln(1.0001) / 2，即 √P = exp(HALF_LN_TICK_BASE * tick)
+# 使用log1p(0.0001)计算，避免1.0001本身的舍入误差随tick放大
+HALF_LN_TICK_BASE = 0.5 * math.log1p(0.0001)
 
 def tick_to_price(tick):
     """
@@ -60,6 +44,20 @@ def tick_to_price(tick):
     """
     return TICK_BASE ** tick
 
+def tick_to_sqrt_price(tick):
+    """
+    将tick索引转换为价格的平方根
+
+    参数:
+        tick: tick索引
+
+    返回:
+        价格的平方根 √P
+
+    公式: √P = 1.0001 ^ (tick / 2) = exp(tick * ln(1.0001) / 2)
+    """
+    return math.exp(HALF_LN_TICK_BASE * tick)
+
 def fee_tier_to_tick_spacing(fee_tier):
     """
     根据池子的费率等级确定tick间距
@@ -80,20 +78,11 @@ def fee_tier_to_tick_spacing(fee_tier):
     }.get(fee_tier, 60)
 
 
-# 查询subgraph
-# 构建HTTP请求
-req = urllib.request.Request(URL)
-req.add_header('Content-Type', 'application/json; charset=utf-8')
-
-# 准备GraphQL查询数据
-jsondata = {"query": query, "variables": {"pool_id": POOL_ID}}
-jsondataasbytes = json.dumps(jsondata).encode('utf-8')
-req.add_header('Content-Length', len(jsondataasbytes))
-
-# 发送请求并获取响应
-response = urllib.request.urlopen(req, jsondataasbytes)
-obj = json.load(response)
-pool = obj['data']['pools'][0]
+# 查询subgraph（在缓存有效期内直接使用缓存的池子信息）
+pool = get_pool(POOL_ID)
+if pool is None:
+    print("pool not found")
+    exit(-1)
 
 # 从响应中提取流动性数据
 L = int(pool["liquidity"])  # 池子的总流动性
@@ -110,10 +99,9 @@ decimals0 = int(pool["token0"]["decimals"])  # USDC有6位小数
 decimals1 = int(pool["token1"]["decimals"])  # WETH有18位小数
 
 # 计算当前tick所在的范围
-# 这段代码在Python中也可以写成: `tick // tick_spacing * tick_spacing`
-# 但是，使用floor()更具可移植性
-bottom_tick = math.floor(tick / tick_spacing) * tick_spacing  # 范围底部tick
-top_tick = bottom_tick + tick_spacing                          # 范围顶部tick
+# Python的整数除法`//`向下取整（负数tick也是如此），不需要经过浮点除法和floor()
+bottom_tick = tick // tick_spacing * tick_spacing  # 范围底部tick
+top_tick = bottom_tick + tick_spacing               # 范围顶部tick
 
 # 计算当前价格并调整为人类可读的格式
 price = tick_to_price(tick)
@@ -121,9 +109,9 @@ price = tick_to_price(tick)
 adjusted_price = price / (10 ** (decimals1 - decimals0))
 
 # 计算对应于底部和顶部tick的价格平方根
-sa = tick_to_price(bottom_tick // 2)  # √P_a (底部tick)
-sb = tick_to_price(top_tick // 2)     # √P_b (顶部tick)
-sp = price ** 0.5                      # √P (当前价格)
+sa = tick_to_sqrt_price(bottom_tick)  # √P_a (底部tick)
+sb = tick_to_sqrt_price(top_tick)     # √P_b (顶部tick)
+sp = tick_to_sqrt_price(tick)         # √P (当前价格)
 
 # 计算当前tick范围内两种资产的实际数量
 # 使用Uniswap v3流动性数学公式
@@ -13,7 +13,9 @@ Uniswap v3 流动性分布范围示例
 """
 
 from gql import gql, Client
-from gql.transport.requests import RequestsHTTPTransport
+from gql.transport.aiohttp import AIOHTTPTransport
+from pool_cache import pool_fields
+import asyncio
 import math
 import sys
 
@@ -24,35 +26,30 @@ POOL_ID = "0x8ad599c3a0ff1de082011efddc58f1908eb6e6d8"
 if len(sys.argv) > 1:
     POOL_ID = sys.argv[1]
 
+# Uniswap v3 subgraph的URL
+URL = 'https://api.thegraph.com/subgraphs/name/uniswap/uniswap-v3'
+
 # Tick基数：每个tick代表0.01%的价格变化
 TICK_BASE = 1.0001
 
-# GraphQL查询：获取池子信息
-pool_query = """query get_pools($pool_id: ID!) {
-  pools(where: {id: $pool_id}) {
-    tick
-    sqrtPrice
-    liquidity
-    feeTier
-    token0 {
-      symbol
-      decimals
-    }
-    token1 {
-      symbol
-      decimals
-    }
-  }
-}"""
-
-# GraphQL查询：获取tick信息
-# 使用分页查询，每次跳过$num_skip个结果
-tick_query = """query get_ticks($num_skip: Int, $pool_id: ID!) {
-  ticks(skip: $num_skip, where: {pool: $pool_id}) {
+# 价格平方根的指数系数：ln(1.0001) / 2，即 √P = exp(HALF_LN_TICK_BASE * tick)
+# 使用log1p(0.0001)计算，避免1.0001本身的舍入误差随tick放大
+HALF_LN_TICK_BASE = 0.5 * math.log1p(0.0001)
+
+# 每个tick分页的大小（subgraph允许的最大值）
+PAGE_SIZE = 1000
+
+# 最小的tick索引
+MIN_TICK = -887272
+
+# GraphQL查询片段：按tick索引升序获取一页tick信息
+# 使用上一页最后一个tick索引作为游标（keyset分页），而不是skip：
+# subgraph处理skip时需要扫描并丢弃前面的所有结果，而且skip的最大值是受限的
+tick_page_fields = """  ticks(first: $page_size, orderBy: tickIdx, orderDirection: asc,
+        where: {pool: $pool_id, tickIdx_gt: $last_tick}) {
     tickIdx
     liquidityNet
-  }
-}"""
+  }"""
 
 
 def tick_to_price(tick):
@@ -69,6 +66,20 @@ def tick_to_price(tick):
     """
     return TICK_BASE ** tick
 
+def tick_to_sqrt_price(tick):
+    """
+    将tick索引转换为价格的平方根
+
+    参数:
+        tick: tick索引
+
+    返回:
+        价格的平方根 √P
+
+    公式: √P = 1.0001 ^ (tick / 2) = exp(tick * ln(1.0001) / 2)
+    """
+    return math.exp(HALF_LN_TICK_BASE * tick)
+
 def fee_tier_to_tick_spacing(fee_tier):
     """
     根据池子的费率等级确定tick间距
@@ -92,84 +103,210 @@ def fee_tier_to_tick_spacing(fee_tier):
         10000: 200
     }.get(fee_tier, 60)
 
+def make_tick_query(include_pool):
+    """
+    构建获取一页tick数据的GraphQL查询
+
+    参数:
+        include_pool: 是否在同一请求中一并查询池子信息
 
-# 创建GraphQL客户端，连接到Uniswap v3 subgraph
-client = Client(
-    transport=RequestsHTTPTransport(
-        url='https://api.thegraph.com/subgraphs/name/uniswap/uniswap-v3',
-        verify=True,
-        retries=5,  # 失败时重试5次
-    ))
+    返回:
+        GraphQL查询字符串
+    """
+    parts = [pool_fields] if include_pool else []
+    parts.append(tick_page_fields)
+    return ("query get_ticks($pool_id: ID!, $page_size: Int!, $last_tick: BigInt!) {\n"
+            + "\n".join(parts) + "\n}")
 
-# 获取池子信息
-try:
-    variables = {"pool_id": POOL_ID}
-    response = client.execute(gql(pool_query), variable_values=variables)
-
-    if len(response['pools']) == 0:
-        print("pool not found")
-        exit(-1)
-
-    pool = response['pools'][0]
-    current_tick = int(pool["tick"])  # 当前价格对应的tick
-    tick_spacing = fee_tier_to_tick_spacing(int(pool["feeTier"]))  # 计算tick间距
-
-    # 获取代币信息
-    token0 = pool["token0"]["symbol"]  # token0的符号（通常是USDC）
-    token1 = pool["token1"]["symbol"]  # token1的符号（通常是WETH）
-    decimals0 = int(pool["token0"]["decimals"])  # token0的小数位数
-    decimals1 = int(pool["token1"]["decimals"])  # token1的小数位数
-except Exception as ex:
-    print("got exception while querying pool data:", ex)
-    exit(-1)
 
-# 获取所有tick信息
-# tick_mapping将tick索引映射到该tick的liquidityNet值
-tick_mapping = {}
-num_skip = 0  # 用于分页查询的偏移量
+def sum_tick_range_amounts(tick_mapping, tick_spacing, current_tick):
+    """
+    按从低到高的顺序遍历所有已初始化的tick，计算相邻两个已初始化tick之间的范围内锁定的代币数量
+
+    相邻两个已初始化tick之间的流动性不变，因此只需处理已初始化的tick，
+    不必逐个tick_spacing遍历大量没有流动性变化的空范围。
+    在流动性不变的范围内，各个tick_spacing子范围的代币数量之和可以直接用范围两端的价格平方根计算。
+    当前tick所在的范围会从包含它的范围中单独拆分出来。
+
+    参数:
+        tick_mapping: 将tick索引映射到该tick的liquidityNet值的字典
+        tick_spacing: tick间距
+        current_tick: 当前价格对应的tick
+
+    返回:
+        (total_amount0, total_amount1, ranges)，
+        其中ranges是(tick_lower, tick_upper, liquidity, amount0, amount1)元组的列表，包含所有有流动性的范围和当前tick所在的范围。
+        当前tick所在范围的amount0和amount1是实际剩余的数量；
+        其他范围的amount0和amount1是该范围内可能存在的数量，实际只锁定其中一种代币
+    """
+    # 从零开始累加流动性
+    # 注意：如果从当前tick开始迭代，应该从池子的总流动性开始
+    liquidity = 0
+
+    # 累计池中的所有代币数量
+    total_amount0 = 0
+    total_amount1 = 0
+    ranges = []
+
+    # 计算当前tick所在的范围的底部和顶部，以及当前价格的平方根
+    current_range_bottom_tick = current_tick // tick_spacing * tick_spacing
+    current_range_top_tick = current_range_bottom_tick + tick_spacing
+    current_sqrt_price = tick_to_sqrt_price(current_tick)
+
+    # 按tick从低到高排序已初始化的tick
+    sorted_ticks = sorted(tick_mapping.items())
+    if not sorted_ticks:
+        return total_amount0, total_amount1, ranges
+
+    # 最底部范围的底部tick的价格平方根
+    sa = tick_to_sqrt_price(sorted_ticks[0][0])
+
+    # 遍历相邻的已初始化tick；最顶部的tick之上没有流动性
+    for (tick, liquidity_delta), (next_tick, _) in zip(sorted_ticks, sorted_ticks[1:]):
+        # 累加该tick的流动性净变化
+        liquidity += liquidity_delta
+
+        # 如果当前tick所在的范围位于[tick, next_tick)之内，将其拆分出来
+        bounds = [tick]
+        if tick < current_range_bottom_tick < next_tick:
+            bounds.append(current_range_bottom_tick)
+        if tick < current_range_top_tick < next_tick:
+            bounds.append(current_range_top_tick)
+        bounds.append(next_tick)
+
+        for tick_lower, tick_upper in zip(bounds, bounds[1:]):
+            # 范围顶部tick的价格平方根，同时也是下一个范围底部tick的价格平方根
+            sb = tick_to_sqrt_price(tick_upper)
+
+            # 计算该范围内可能存在的代币数量
+            # 无论当前价格高于还是低于此范围，计算方法都相同，区别只在于实际锁定的是哪种代币
+            amount1 = liquidity * (sb - sa)
+            amount0 = amount1 / (sb * sa)
+
+            if tick_upper <= current_range_bottom_tick:
+                # 当前价格高于此范围，仅token1被锁定
+                total_amount1 += amount1
+
+            elif tick_lower >= current_range_top_tick:
+                # 当前价格低于此范围，仅token0被锁定
+                total_amount0 += amount0
+
+            else:
+                # 当前tick范围：通常两种资产都存在
+                # 计算需要交换以移出当前tick范围的两种资产的实际数量
+                amount0 = liquidity * (sb - current_sqrt_price) / (current_sqrt_price * sb)
+                amount1 = liquidity * (current_sqrt_price - sa)
+
+                total_amount0 += amount0
+                total_amount1 += amount1
+
+            # 只记录有流动性的范围，以及当前tick所在的范围
+            if liquidity != 0 or tick_lower == current_range_bottom_tick:
+                ranges.append((tick_lower, tick_upper, liquidity, amount0, amount1))
+
+            sa = sb
+
+    # 最顶部的已初始化tick之上没有下一个tick，循环不会处理从它开始的范围；
+    # 如果当前tick所在的范围恰好从这里开始，仍然需要计算并记录当前tick范围
+    top_tick, top_liquidity_delta = sorted_ticks[-1]
+    if current_range_bottom_tick == top_tick:
+        liquidity += top_liquidity_delta
+        # 此时sa是最顶部tick的价格平方根
+        sb = tick_to_sqrt_price(current_range_top_tick)
+        amount0 = liquidity * (sb - current_sqrt_price) / (current_sqrt_price * sb)
+        amount1 = liquidity * (current_sqrt_price - sa)
+
+        total_amount0 += amount0
+        total_amount1 += amount1
+        ranges.append((top_tick, current_range_top_tick, liquidity, amount0, amount1))
+
+    return total_amount0, total_amount1, ranges
+
+
+# 预先解析两种查询（是否一并查询池子信息），分页时不必为每一页重新解析查询字符串
+tick_query_with_pool = gql(make_tick_query(include_pool=True))
+tick_query = gql(make_tick_query(include_pool=False))
+
+
+async def query_pool_and_ticks():
+    """
+    查询池子信息和池子的所有tick信息
+
+    按tick索引升序逐页查询，直到某一页不满为止。
+    池子信息随第一个请求一并查询，与第一页数据来自同一时刻的快照。
+
+    返回:
+        (pool, tick_mapping)，其中tick_mapping将tick索引映射到该tick的liquidityNet值
+    """
+    # 池子信息随第一个请求一并查询；不使用缓存，以免当前tick和价格比tick数据更旧
+    pool = None
+    tick_mapping = {}
+    last_tick = MIN_TICK - 1  # 分页游标：上一页最后一个tick索引
+
+    # 创建GraphQL客户端，连接到Uniswap v3 subgraph
+    # 所有请求复用同一个HTTP会话；reconnecting=True时失败的请求会自动重试
+    client = Client(transport=AIOHTTPTransport(url=URL))
+    session = await client.connect_async(reconnecting=True)
+    try:
+        while True:
+            print("Querying ticks, last_tick={}".format(last_tick))
+            variables = {"pool_id": POOL_ID, "page_size": PAGE_SIZE, "last_tick": str(last_tick)}
+            query = tick_query_with_pool if pool is None else tick_query
+            response = await session.execute(query, variable_values=variables)
+
+            if pool is None:
+                if len(response['pools']) == 0:
+                    print("pool not found")
+                    exit(-1)
+                pool = response['pools'][0]
+
+            # 将tick数据存储到映射中
+            # liquidityNet表示跨过该tick时流动性的净变化
+            ticks = response["ticks"]
+            # subgraph以字符串形式返回数值字段，需要转换为整数
+            tick_mapping.update(
+                (int(item["tickIdx"]), int(item["liquidityNet"])) for item in ticks)
+
+            # 如果这一页不满，说明已经没有更多结果
+            if len(ticks) < PAGE_SIZE:
+                return pool, tick_mapping
+
+            # 更新游标，准备下一次查询
+            last_tick = int(ticks[-1]["tickIdx"])
+    finally:
+        await client.close_async()
+
+
+# 获取池子信息和所有tick信息
 try:
-    while True:
-        print("Querying ticks, num_skip={}".format(num_skip))
-        variables = {"num_skip": num_skip, "pool_id": POOL_ID}
-        response = client.execute(gql(tick_query), variable_values=variables)
-
-        # 如果没有更多结果，退出循环
-        if len(response["ticks"]) == 0:
-            break
-        
-        # 更新偏移量，准备下一次查询
-        num_skip += len(response["ticks"])
-        
-        # 将tick数据存储到映射中
-        # liquidityNet表示跨过该tick时流动性的净变化
-        for item in response["ticks"]:
-            tick_mapping[int(item["tickIdx"])] = int(item["liquidityNet"])
+    pool, tick_mapping = asyncio.run(query_pool_and_ticks())
 except Exception as ex:
-    print("got exception while querying tick data:", ex)
+    print("got exception while querying pool and tick data:", ex)
     exit(-1)
 
-    
-# 从零开始累加流动性
-# 注意：如果从当前tick开始迭代，应该从池子的总流动性开始
-liquidity = 0
+current_tick = int(pool["tick"])  # 当前价格对应的tick
+tick_spacing = fee_tier_to_tick_spacing(int(pool["feeTier"]))  # 计算tick间距
 
-# 找到价格范围的边界
-min_tick = min(tick_mapping.keys())  # 最小tick（最低价格）
-max_tick = max(tick_mapping.keys())  # 最大tick（最高价格）
+# 获取代币信息
+token0 = pool["token0"]["symbol"]  # token0的符号（通常是USDC）
+token1 = pool["token1"]["symbol"]  # token1的符号（通常是WETH）
+decimals0 = int(pool["token0"]["decimals"])  # token0的小数位数
+decimals1 = int(pool["token1"]["decimals"])  # token1的小数位数
+
+# 将原始数量和价格调整为人类可读格式（考虑小数位数）所用的系数
+# 只计算一次，之后用乘法代替每次的幂运算和除法
+inv_scale0 = 10.0 ** -decimals0
+inv_scale1 = 10.0 ** -decimals1
+inv_price_scale = 10.0 ** (decimals0 - decimals1)
 
 # 计算当前tick所在的范围底部
-# 这段代码在Python中也可以写成: `current_tick // tick_spacing * tick_spacing`
-# 但是，使用floor()更具可移植性
-current_range_bottom_tick = math.floor(current_tick / tick_spacing) * tick_spacing
+# Python的整数除法`//`向下取整（负数tick也是如此），不需要经过浮点除法和floor()
+current_range_bottom_tick = current_tick // tick_spacing * tick_spacing
 
 # 计算当前价格
 current_price = tick_to_price(current_tick)
 # 调整价格以考虑代币的小数位数差异
-adjusted_current_price = current_price / (10 ** (decimals1 - decimals0))
-
-# 累计池中的所有代币数量
-total_amount0 = 0
-total_amount1 = 0
+adjusted_current_price = current_price * inv_price_scale
 
 
 # 猜测显示价格的首选方式：
@@ -185,86 +322,48 @@ elif adjusted_current_price < 1.0:
 else:
     invert_price = False
 
-# 从最底部的tick开始遍历tick映射
-tick = min_tick
-while tick <= max_tick:
-    # 获取该tick的流动性净变化
-    liquidity_delta = tick_mapping.get(tick, 0)
-    liquidity += liquidity_delta  # 累加流动性
+# 价格显示所用的代币顺序在整个循环中不变，只需格式化一次
+if invert_price:
+    tokens = "{} for {}".format(token0, token1)
+else:
+    tokens = "{} for {}".format(token1, token0)
 
-    # 计算该tick对应的价格
-    price = tick_to_price(tick)
-    adjusted_price = price / (10 ** (decimals1 - decimals0))
-    
-    # 根据需要反转价格显示
-    if invert_price:
-        adjusted_price = 1 / adjusted_price
-        tokens = "{} for {}".format(token0, token1)
-    else:
-        tokens = "{} for {}".format(token1, token0)
+# 遍历所有tick范围，累计池中的所有代币数量
+total_amount0, total_amount1, ranges = sum_tick_range_amounts(tick_mapping, tick_spacing, current_tick)
 
+for tick_lower, tick_upper, liquidity, amount0, amount1 in ranges:
     # 只打印有流动性的tick
     should_print_tick = liquidity != 0
     if should_print_tick:
-        print("ticks=[{}, {}], bottom tick price={:.6f} {}".format(tick, tick + tick_spacing, adjusted_price, tokens))
-
-    # 计算对应于底部和顶部tick的价格平方根
-    bottom_tick = tick
-    top_tick = bottom_tick + tick_spacing
-    sa = tick_to_price(bottom_tick // 2)  # 底部tick的价格平方根
-    sb = tick_to_price(top_tick // 2)     # 顶部tick的价格平方根
-
-    if tick < current_range_bottom_tick:
+        # 计算该tick对应的价格，仅在需要打印时计算
+        price = tick_to_price(tick_lower)
+        adjusted_price = price * inv_price_scale
+        # 根据需要反转价格显示
+        if invert_price:
+            adjusted_price = 1 / adjusted_price
+        print("ticks=[{}, {}], bottom tick price={:.6f} {}".format(tick_lower, tick_upper, adjusted_price, tokens))
+
+    adjusted_amount0 = amount0 * inv_scale0
+    adjusted_amount1 = amount1 * inv_scale1
+
+    if tick_lower < current_range_bottom_tick:
         # 当前价格高于此范围，只有token1被锁定
-        # 计算该范围内可能存在的代币数量
-        amount1 = liquidity * (sb - sa)
-        amount0 = amount1 / (sb * sa)
-
-        # 仅token1被锁定
-        total_amount1 += amount1
-
-        if should_print_tick:
-            adjusted_amount0 = amount0 / (10 ** decimals0)
-            adjusted_amount1 = amount1 / (10 ** decimals1)
-            print("        {:.2f} {} locked, potentially worth {:.2f} {}".format(adjusted_amount1, token1, adjusted_amount0, token0))
+        print("        {:.2f} {} locked, potentially worth {:.2f} {}".format(adjusted_amount1, token1, adjusted_amount0, token0))
 
-    elif tick == current_range_bottom_tick:
+    elif tick_lower == current_range_bottom_tick:
         # 当前tick范围：通常两种资产都存在
         # 总是打印当前tick的信息
         print("        Current tick, both assets present!")
         print("        Current price={:.6f} {}".format(1 / adjusted_current_price if invert_price else adjusted_current_price, tokens))
 
         # 打印需要交换以移出当前tick范围的两种资产的实际数量
-        current_sqrt_price = tick_to_price(current_tick / 2)
-        amount0actual = liquidity * (sb - current_sqrt_price) / (current_sqrt_price * sb)
-        amount1actual = liquidity * (current_sqrt_price - sa)
-        adjusted_amount0actual = amount0actual / (10 ** decimals0)
-        adjusted_amount1actual = amount1actual / (10 ** decimals1)
-
-        total_amount0 += amount0actual
-        total_amount1 += amount1actual
-
         print("        {:.2f} {} and {:.2f} {} remaining in the current tick range".format(
-            adjusted_amount0actual, token0, adjusted_amount1actual, token1))
-
+            adjusted_amount0, token0, adjusted_amount1, token1))
 
     else:
         # 当前价格低于此范围，只有token0被锁定
-        # 计算该范围内可能存在的代币数量
-        amount1 = liquidity * (sb - sa)
-        amount0 = amount1 / (sb * sa)
-
-        # 仅token0被锁定
-        total_amount0 += amount0
-
-        if should_print_tick:
-            adjusted_amount0 = amount0 / (10 ** decimals0)
-            adjusted_amount1 = amount1 / (10 ** decimals1)
-            print("        {:.2f} {} locked, potentially worth {:.2f} {}".format(adjusted_amount0, token0, adjusted_amount1, token1))
-
-    # 移动到下一个tick
-    tick += tick_spacing
+        print("        {:.2f} {} locked, potentially worth {:.2f} {}".format(adjusted_amount0, token0, adjusted_amount1, token1))
 
 # 打印池中锁定的代币总量
 print("In total: {:.2f} {} and {:.2f} {}".format(
-      total_amount0 / 10 ** decimals0, token0, total_amount1 / 10 ** decimals1, token1))
+      total_amount0 * inv_scale0, token0, total_amount1 * inv_scale1, token1))
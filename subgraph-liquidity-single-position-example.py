@@ -27,13 +27,27 @@ if len(sys.argv) > 1:
 # Tick基数：每个tick代表0.01%的价格变化
 TICK_BASE = 1.0001
 
+# 价格平方根的指数系数：ln(1.0001) / 2，即 √P = exp(HALF_LN_TICK_BASE * tick)
+# 使用log1p(0.0001)计算，避免1.0001本身的舍入误差随tick放大
+HALF_LN_TICK_BASE = 0.5 * math.log1p(0.0001)
+
+# Q64.96定点数的缩放因子的倒数：1 / 2^96
+# 2的幂的倒数可以精确表示为浮点数，乘以它与除以2^96的结果完全相同
+INV_Q96 = 1.0 / (1 << 96)
+
 # GraphQL查询：获取头寸信息
+# 池子的当前tick和价格平方根作为嵌套字段一并查询，
+# 这样只需要一次网络往返，而不必在得到池子ID后再单独查询池子
 position_query = """query get_position($position_id: ID!) {
   positions(where: {id: $position_id}) {
     liquidity
     tickLower { tickIdx }
     tickUpper { tickIdx }
-    pool { id }
+    pool {
+      id
+      tick
+      sqrtPrice
+    }
     token0 {
       symbol
       decimals
@@ -45,14 +59,6 @@ position_query = """query get_position($position_id: ID!) {
   }
 }"""
 
-# GraphQL查询：获取池子的当前tick和价格平方根
-pool_query = """query get_pools($pool_id: ID!) {
-  pools(where: {id: $pool_id}) {
-    tick
-    sqrtPrice
-  }
-}"""
-
 def tick_to_price(tick):
     """
     将tick索引转换为价格
@@ -65,6 +71,20 @@ def tick_to_price(tick):
     """
     return TICK_BASE ** tick
 
+def tick_to_sqrt_price(tick):
+    """
+    将tick索引转换为价格的平方根
+
+    参数:
+        tick: tick索引
+
+    返回:
+        价格的平方根 √P
+
+    公式: √P = 1.0001 ^ (tick / 2) = exp(tick * ln(1.0001) / 2)
+    """
+    return math.exp(HALF_LN_TICK_BASE * tick)
+
 # 创建GraphQL客户端
 client = Client(
     transport=RequestsHTTPTransport(
@@ -73,7 +93,7 @@ client = Client(
         retries=5,
     ))
 
-# 获取头寸信息
+# 获取头寸信息及其所在池子的当前价格
 try:
     variables = {"position_id": POSITION_ID}
     response = client.execute(gql(position_query), variable_values=variables)
@@ -86,7 +106,6 @@ try:
     liquidity = int(position["liquidity"])  # 头寸的流动性
     tick_lower = int(position["tickLower"]["tickIdx"])  # 价格范围下限tick
     tick_upper = int(position["tickUpper"]["tickIdx"])  # 价格范围上限tick
-    pool_id = position["pool"]["id"]  # 池子ID
 
     # 获取代币信息
     token0 = position["token0"]["symbol"]
@@ -94,28 +113,15 @@ try:
     decimals0 = int(position["token0"]["decimals"])
     decimals1 = int(position["token1"]["decimals"])
 
-except Exception as ex:
-    print("got exception while querying position data:", ex)
-    exit(-1)
-
-#print("pool id=", pool_id)
-
-# 获取池子信息以得到当前价格
-try:
-    variables = {"pool_id": pool_id}
-    response = client.execute(gql(pool_query), variable_values=variables)
-
-    if len(response['pools']) == 0:
-        print("pool not found")
-        exit(-1)
-
-    pool = response['pools'][0]
+    pool = position["pool"]
+    pool_id = pool["id"]  # 池子ID
+    #print("pool id=", pool_id)
     current_tick = int(pool["tick"])  # 当前价格对应的tick
     # sqrtPrice存储为Q64.96格式的定点数，需要除以2^96
-    current_sqrt_price = int(pool["sqrtPrice"]) / (2 ** 96)
+    current_sqrt_price = int(pool["sqrtPrice"]) * INV_Q96
 
 except Exception as ex:
-    print("got exception while querying pool data:", ex)
+    print("got exception while querying position data:", ex)
     exit(-1)
 
 # 计算并打印当前价格
@@ -124,8 +130,8 @@ adjusted_current_price = current_price / (10 ** (decimals1 - decimals0))
 print("Current price={:.6f} {} for {} at tick {}".format(adjusted_current_price, token1, token0, current_tick))
 
 # 计算头寸价格范围边界的平方根
-sa = tick_to_price(tick_lower / 2)  # √P_a
-sb = tick_to_price(tick_upper / 2)  # √P_b
+sa = tick_to_sqrt_price(tick_lower)  # √P_a
+sb = tick_to_sqrt_price(tick_upper)  # √P_b
 
 # 根据当前价格位置计算头寸中的代币数量
 if tick_upper <= current_tick:
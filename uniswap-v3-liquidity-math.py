@@ -11,6 +11,10 @@ Uniswap v3 流动性数学计算模块
 - 计算价格边界
 """
 
+import bisect
+import math
+import sys
+
 #
 # 流动性数学函数改编自:
 # https://github.com/Uniswap/uniswap-v3-periphery/blob/main/contracts/libraries/LiquidityAmounts.sol
@@ -125,6 +129,272 @@ def calculate_y(L, sp, sa, sb):
     sp = max(min(sp, sb), sa)     # 如果价格在范围外，使用范围端点值
     return L * (sp - sa)
 
+def calculate_xy(L, sp, sa, sb):
+    """
+    根据流动性同时计算token0和token1的数量
+
+    与分别调用calculate_x()和calculate_y()的结果相同，但只需要将价格限制在范围内一次。
+
+    参数:
+        L: 流动性
+        sp: 当前价格的平方根 (√P)
+        sa: 价格下限的平方根 (√P_a)
+        sb: 价格上限的平方根 (√P_b)
+
+    返回:
+        (x, y)，即token0和token1的数量
+
+    注意：如果价格超出范围，会使用范围边界值
+    """
+    sp = max(min(sp, sb), sa)     # 如果价格在范围外，使用范围端点值
+    return L * (sb - sp) / (sp * sb), L * (sp - sa)
+
+def calculate_x_batch(liquidities, sp, sa, sb):
+    """
+    在同一价格和价格范围下，计算多个流动性值对应的token0数量
+
+    token0的数量与流动性成正比，每单位流动性对应的数量只需计算一次，
+    之后每个流动性值只需一次乘法。
+
+    参数:
+        liquidities: 流动性值的序列
+        sp: 当前价格的平方根 (√P)
+        sa: 价格下限的平方根 (√P_a)
+        sb: 价格上限的平方根 (√P_b)
+
+    返回:
+        token0数量的列表，与liquidities一一对应
+    """
+    sp = max(min(sp, sb), sa)     # 如果价格在范围外，使用范围端点值
+    k = (sb - sp) / (sp * sb)     # 每单位流动性对应的token0数量
+    return [L * k for L in liquidities]
+
+def calculate_y_batch(liquidities, sp, sa, sb):
+    """
+    在同一价格和价格范围下，计算多个流动性值对应的token1数量
+
+    参数:
+        liquidities: 流动性值的序列
+        sp: 当前价格的平方根 (√P)
+        sa: 价格下限的平方根 (√P_a)
+        sb: 价格上限的平方根 (√P_b)
+
+    返回:
+        token1数量的列表，与liquidities一一对应
+    """
+    sp = max(min(sp, sb), sa)     # 如果价格在范围外，使用范围端点值
+    k = sp - sa                   # 每单位流动性对应的token1数量
+    return [L * k for L in liquidities]
+
+def calculate_xy_path(L, sp_path, sa, sb):
+    """
+    计算同一头寸在一系列价格下的token0和token1数量
+
+    价格按升序排列（例如模拟价格沿某一方向变化），因此可以用二分查找
+    找到价格低于范围和高于范围的两段：这两段中代币数量是常数，
+    不需要逐个价格限制范围和计算，只有范围内的价格需要逐个计算。
+
+    参数:
+        L: 流动性
+        sp_path: 按升序排列的价格平方根序列
+        sa: 价格下限的平方根 (√P_a)
+        sb: 价格上限的平方根 (√P_b)
+
+    返回:
+        (xs, ys)，即每个价格下token0和token1数量的列表
+    """
+    i_lo = bisect.bisect_right(sp_path, sa)  # sp_path[:i_lo]中的价格低于或等于价格下限
+    i_hi = bisect.bisect_left(sp_path, sb)   # sp_path[i_hi:]中的价格高于或等于价格上限
+    n_above = len(sp_path) - i_hi
+    middle = sp_path[i_lo:i_hi]
+
+    # 价格低于范围时只有token0，高于范围时只有token1
+    x_below = L * (sb - sa) / (sa * sb)
+    y_above = L * (sb - sa)
+
+    xs = [x_below] * i_lo + [L * (sb - sp) / (sp * sb) for sp in middle] + [0.0] * n_above
+    ys = [0.0] * i_lo + [L * (sp - sa) for sp in middle] + [y_above] * n_above
+    return xs, ys
+
+
+#
+# 根据tick计算价格的平方根
+#
+# 每个tick对应的价格为 P(i) = 1.0001^i，因此 √P(i) = 1.0001^(i/2) = exp(i * ln(1.0001) / 2)
+# ln(1.0001)使用log1p(0.0001)计算，避免1.0001本身的舍入误差随tick放大：
+# 在tick=887272处相对误差约为3e-15，而(1.0001 ** 0.5) ** tick的相对误差约为9e-11。
+# 各个subgraph示例脚本中的tick_to_sqrt_price()使用相同的公式。
+#
+HALF_LN_TICK_BASE = 0.5 * math.log1p(0.0001)
+
+def tick_to_sqrt_price(tick):
+    """
+    计算tick对应的价格平方根
+
+    参数:
+        tick: tick索引
+
+    返回:
+        价格的平方根 √P
+
+    公式: √P = exp(tick * ln(1.0001) / 2)
+    """
+    return math.exp(HALF_LN_TICK_BASE * tick)
+
+#
+# 上述函数的整数版本，使用Q64.96定点数表示的价格平方根（即链上的sqrtPriceX96）
+#
+# 与合约中的计算方法相同：包括向下取整，以及流动性超出uint128范围时的溢出检查（合约中会回滚，这里抛出OverflowError），
+# 对于合约能接受的输入，结果与链上一致，不存在浮点误差。
+# Python的整数是任意精度的，因此不需要合约中FullMath.mulDiv的512位中间结果处理。
+#
+Q96 = 1 << 96
+MAX_UINT128 = (1 << 128) - 1
+
+def to_uint128(value):
+    """
+    对应合约中的toUint128()：检查流动性是否在uint128范围内
+
+    参数:
+        value: 非负整数
+
+    返回:
+        value本身；如果超出uint128范围，抛出OverflowError（合约中此时会回滚）
+    """
+    if value > MAX_UINT128:
+        raise OverflowError("liquidity {} does not fit in uint128".format(value))
+    return value
+
+def price_to_sqrt_price_q96(p):
+    """
+    将价格转换为Q64.96格式的价格平方根（即sqrtPriceX96）
+
+    参数:
+        p: 价格 P（token1/token0，按最小单位计）
+
+    返回:
+        ⌊√P * 2^96⌋（整数）
+
+    乘以2^192对浮点数是精确的，之后的整数平方根也是精确的，
+    因此结果只受输入价格本身的浮点表示影响。
+    """
+    return math.isqrt(int(p * (1 << 192)))
+
+def get_liquidity_0_q96(x, sa, sb):
+    """
+    get_liquidity_0()的整数版本，对应合约中的getLiquidityForAmount0()
+
+    参数:
+        x: token0的数量（最小单位的整数）
+        sa: 价格下限的平方根，Q64.96格式
+        sb: 价格上限的平方根，Q64.96格式
+
+    返回:
+        流动性 L（整数）
+    """
+    if sa > sb:
+        sa, sb = sb, sa
+    intermediate = sa * sb // Q96
+    return to_uint128(x * intermediate // (sb - sa))
+
+def get_liquidity_1_q96(y, sa, sb):
+    """
+    get_liquidity_1()的整数版本，对应合约中的getLiquidityForAmount1()
+
+    参数:
+        y: token1的数量（最小单位的整数）
+        sa: 价格下限的平方根，Q64.96格式
+        sb: 价格上限的平方根，Q64.96格式
+
+    返回:
+        流动性 L（整数）
+    """
+    if sa > sb:
+        sa, sb = sb, sa
+    return to_uint128(y * Q96 // (sb - sa))
+
+def get_liquidity_q96(x, y, sp, sa, sb):
+    """
+    get_liquidity()的整数版本，对应合约中的getLiquidityForAmounts()
+
+    参数:
+        x: token0的数量（最小单位的整数）
+        y: token1的数量（最小单位的整数）
+        sp: 当前价格的平方根，Q64.96格式
+        sa: 价格下限的平方根，Q64.96格式
+        sb: 价格上限的平方根，Q64.96格式
+
+    返回:
+        流动性 L（整数）
+    """
+    if sa > sb:
+        sa, sb = sb, sa
+    if sp <= sa:
+        # 当前价格低于或等于价格下限，仅使用token0
+        return get_liquidity_0_q96(x, sa, sb)
+    if sp < sb:
+        # 当前价格在范围内，取两者中的较小值
+        return min(get_liquidity_0_q96(x, sp, sb), get_liquidity_1_q96(y, sa, sp))
+    # 当前价格高于或等于价格上限，仅使用token1
+    return get_liquidity_1_q96(y, sa, sb)
+
+def get_amount_0_q96(L, sa, sb):
+    """
+    计算价格从√P_a变化到√P_b时token0的数量，对应合约中的getAmount0ForLiquidity()
+
+    参数:
+        L: 流动性（整数）
+        sa: 价格下限的平方根，Q64.96格式
+        sb: 价格上限的平方根，Q64.96格式
+
+    返回:
+        token0的数量（整数，向下取整）
+
+    公式: x = L * 2^96 * (√P_b - √P_a) / √P_b / √P_a
+    """
+    if sa > sb:
+        sa, sb = sb, sa
+    return (L << 96) * (sb - sa) // sb // sa
+
+def get_amount_1_q96(L, sa, sb):
+    """
+    计算价格从√P_a变化到√P_b时token1的数量，对应合约中的getAmount1ForLiquidity()
+
+    参数:
+        L: 流动性（整数）
+        sa: 价格下限的平方根，Q64.96格式
+        sb: 价格上限的平方根，Q64.96格式
+
+    返回:
+        token1的数量（整数，向下取整）
+
+    公式: y = L * (√P_b - √P_a) / 2^96
+    """
+    if sa > sb:
+        sa, sb = sb, sa
+    return L * (sb - sa) // Q96
+
+def get_amounts_q96(L, sp, sa, sb):
+    """
+    calculate_xy()的整数版本，对应合约中的getAmountsForLiquidity()
+
+    参数:
+        L: 流动性（整数）
+        sp: 当前价格的平方根，Q64.96格式
+        sa: 价格下限的平方根，Q64.96格式
+        sb: 价格上限的平方根，Q64.96格式
+
+    返回:
+        (x, y)，即token0和token1的数量（整数）
+    """
+    if sa > sb:
+        sa, sb = sb, sa
+    if sp <= sa:
+        return get_amount_0_q96(L, sa, sb), 0
+    if sp < sb:
+        return get_amount_0_q96(L, sp, sb), get_amount_1_q96(L, sa, sp)
+    return 0, get_amount_1_q96(L, sa, sb)
+
 
 #
 # 计算价格下限的两种不同方法
@@ -150,7 +420,8 @@ def calculate_a1(L, sp, sb, x, y):
     """
     # https://www.wolframalpha.com/input/?i=solve+L+%3D+y+%2F+%28sqrt%28P%29+-+a%29+for+a
     # sqrt(a) = sqrt(P) - y / L
-    return (sp - y / L) ** 2
+    sa = sp - y / L
+    return sa * sa
 
 def calculate_a2(sp, sb, x, y):
     """
@@ -173,8 +444,10 @@ def calculate_a2(sp, sb, x, y):
     # sqrt(a) = (y/sqrt(b) + sqrt(P) x - y/sqrt(P))/x
     #    简化为:
     # sqrt(a) = y/(sqrt(b) x) + sqrt(P) - y/(sqrt(P) x)
-    sa = y / (sb * x) + sp - y / (sp * x)
-    return sa ** 2
+    # 两项共同的y/x只计算一次
+    y_x = y / x
+    sa = y_x / sb + sp - y_x / sp
+    return sa * sa
 
 #
 # 计算价格上限的两种不同方法
@@ -200,7 +473,8 @@ def calculate_b1(L, sp, sa, x, y):
     """
     # https://www.wolframalpha.com/input/?i=solve+L+%3D+x+sqrt%28P%29+sqrt%28b%29+%2F+%28sqrt%28b%29+-+sqrt%28P%29%29+for+b
     # sqrt(b) = (L sqrt(P)) / (L - sqrt(P) x)
-    return ((L * sp) / (L - sp * x)) ** 2
+    sb = (L * sp) / (L - sp * x)
+    return sb * sb
 
 def calculate_b2(sp, sa, x, y):
     """
@@ -222,8 +496,9 @@ def calculate_b2(sp, sa, x, y):
     # 找到 b 的平方根:
     # https://www.wolframalpha.com/input/?i=solve+++x+sqrt%28P%29+b+%2F+%28b++-+sqrt%28P%29%29+%3D+y+%2F+%28sqrt%28P%29+-+sqrt%28a%29%29%2C+for+b
     # sqrt(b) = (sqrt(P) y)/(sqrt(a) sqrt(P) x - P x + y)
-    P = sp ** 2
-    return (sp * y / ((sa * sp - P) * x + y)) ** 2
+    # 其中 sqrt(a) sqrt(P) - P = sqrt(P) (sqrt(a) - sqrt(P))，不需要单独计算P
+    sb = sp * y / (sp * (sa - sp) * x + y)
+    return sb * sb
 
 #
 # 计算价格比率 c 和 d
@@ -269,7 +544,7 @@ def calculate_d(p, c, x, y):
 #  -- 为了简单起见，忽略了tick和tick范围
 #  -- 测试值来自 Uniswap v3 UI，是近似值
 #
-def test(x, y, p, a, b):
+def test(x, y, p, a, b, verbose=True):
     """
     测试流动性计算函数的准确性
     
@@ -279,38 +554,44 @@ def test(x, y, p, a, b):
         p: 当前价格
         a: 价格下限
         b: 价格上限
+        verbose: 是否打印测试结果
+    
+    返回:
+        (L, results)，其中results是(名称, 输入值, 计算值, 误差百分比)元组的列表
     
     该函数会计算流动性，然后使用不同的方法重新计算价格边界，
     并比较计算结果与输入值之间的误差。
+    打印时所有结果一次性写出；verbose为False时不做任何格式化和输出，适合重复运行大量测试。
     """
+    results = []
+
     # 计算价格的平方根
-    sp = p ** 0.5
-    sa = a ** 0.5
-    sb = b ** 0.5
+    sp = math.sqrt(p)
+    sa = math.sqrt(a)
+    sb = math.sqrt(b)
 
     # 计算流动性
     L = get_liquidity(x, y, sp, sa, sb)
-    print("L: {:.2f}".format(L))
 
     # 使用方法1计算价格下限并验证误差
     ia = calculate_a1(L, sp, sb, x, y)
-    error = 100.0 * (1 - ia / a)
-    print("a: {:.2f} vs {:.2f}, error {:.6f}%".format(a, ia, error))
+    error = 100.0 * (a - ia) / a
+    results.append(("a", a, ia, error))
 
     # 使用方法2计算价格下限并验证误差
     ia = calculate_a2(sp, sb, x, y)
-    error = 100.0 * (1 - ia / a)
-    print("a: {:.2f} vs {:.2f}, error {:.6f}%".format(a, ia, error))
+    error = 100.0 * (a - ia) / a
+    results.append(("a", a, ia, error))
 
     # 使用方法1计算价格上限并验证误差
     ib = calculate_b1(L, sp, sa, x, y)
-    error = 100.0 * (1 - ib / b)
-    print("b: {:.2f} vs {:.2f}, error {:.6f}%".format(b, ib, error))
+    error = 100.0 * (b - ib) / b
+    results.append(("b", b, ib, error))
 
     # 使用方法2计算价格上限并验证误差
     ib = calculate_b2(sp, sa, x, y)
-    error = 100.0 * (1 - ib / b)
-    print("b: {:.2f} vs {:.2f}, error {:.6f}%".format(b, ib, error))
+    error = 100.0 * (b - ib) / b
+    results.append(("b", b, ib, error))
 
     # 计算价格比率
     c = sb / sp  # c = √P_b / √P
@@ -318,23 +599,31 @@ def test(x, y, p, a, b):
     
     # 验证 c 值的计算
     ic = calculate_c(p, d, x, y)
-    error = 100.0 * (1 - ic / c)
-    print("c^2: {:.2f} vs {:.2f}, error {:.6f}%".format(c**2, ic**2, error))
+    error = 100.0 * (c - ic) / c
+    results.append(("c^2", c * c, ic * ic, error))
 
     # 验证 d 值的计算
     id = calculate_d(p, c, x, y)
-    error = 100.0 * (1 - id**2 / d**2)
-    print("d^2: {:.2f} vs {:.2f}, error {:.6f}%".format(d**2, id**2, error))
+    error = 100.0 * (d * d - id * id) / (d * d)
+    results.append(("d^2", d * d, id * id, error))
 
     # 使用流动性重新计算代币数量并验证误差
-    ix = calculate_x(L, sp, sa, sb)
-    error = 100.0 * (1 - ix / x)
-    print("x: {:.2f} vs {:.2f}, error {:.6f}%".format(x, ix, error))
+    ix, iy = calculate_xy(L, sp, sa, sb)
+    error = 100.0 * (x - ix) / x
+    results.append(("x", x, ix, error))
 
-    iy = calculate_y(L, sp, sa, sb)
-    error = 100.0 * (1 - iy / y)
-    print("y: {:.2f} vs {:.2f}, error {:.6f}%".format(y, iy, error))
-    print("")
+    error = 100.0 * (y - iy) / y
+    results.append(("y", y, iy, error))
+
+    if verbose:
+        # 拼接所有结果，只写一次标准输出
+        lines = ["L: {:.2f}".format(L)]
+        for name, value, computed, error in results:
+            lines.append("{}: {:.2f} vs {:.2f}, error {:.6f}%".format(name, value, computed, error))
+        lines.append("")
+        sys.stdout.write("\n".join(lines) + "\n")
+
+    return L, results
 
 
 def test_1():
@@ -383,9 +672,9 @@ def example_1():
     x = 2     # 提供2个ETH (token0)
 
     # 计算价格的平方根
-    sp = p ** 0.5
-    sa = a ** 0.5
-    sb = b ** 0.5
+    sp = math.sqrt(p)
+    sa = math.sqrt(a)
+    sb = math.sqrt(b)
     
     # 首先使用token0计算流动性
     L = get_liquidity_0(x, sp, sb)
@@ -398,8 +687,8 @@ def example_1():
     d = sa / sp  # 价格下限比率
     ic = calculate_c(p, d, x, y)
     id = calculate_d(p, c, x, y)
-    C = ic ** 2  # 转换回价格比率
-    D = id ** 2  # 转换回价格比率
+    C = ic * ic  # 转换回价格比率
+    D = id * id  # 转换回价格比率
     print("p_a={:.2f} ({:.2f}% of P), p_b={:.2f} ({:.2f}% of P)".format(
         D * p, D * 100, C * p, C * 100))
     print("")
@@ -425,8 +714,8 @@ def example_2():
     y = 4000   # 4000 USDC
 
     # 计算价格的平方根
-    sp = p ** 0.5
-    sb = b ** 0.5
+    sp = math.sqrt(p)
+    sb = math.sqrt(b)
 
     # 使用方法2计算价格下限（不需要流动性）
     a = calculate_a2(sp, sb, x, y)
@@ -457,20 +746,19 @@ def example_3():
     y = 4000     # 初始USDC数量
 
     # 计算初始价格的平方根
-    sp = p ** 0.5
-    sa = a ** 0.5
-    sb = b ** 0.5
+    sp = math.sqrt(p)
+    sa = math.sqrt(a)
+    sb = math.sqrt(b)
     
     # 计算初始流动性
     L = get_liquidity(x, y, sp, sa, sb)
 
     # 新的价格
     P1 = 2500
-    sp1 = P1 ** 0.5
+    sp1 = math.sqrt(P1)
 
     # 方法1：直接使用流动性公式计算新价格下的资产数量
-    x1 = calculate_x(L, sp1, sa, sb)
-    y1 = calculate_y(L, sp1, sa, sb)
+    x1, y1 = calculate_xy(L, sp1, sa, sb)
     print("Amount of ETH x={:.2f} amount of USDC y={:.2f}".format(x1, y1))
 
     # 方法2：使用白皮书中的增量计算方法
@@ -480,19 +768,123 @@ def example_3():
     sp = max(min(sp, sb), sa)
     sp1 = max(min(sp1, sb), sa)
 
-    # 计算价格变化
-    delta_p = sp1 - sp           # 价格平方根的变化
-    delta_inv_p = 1/sp1 - 1/sp   # 价格平方根倒数的变化
-    
-    # 根据流动性和价格变化计算资产变化
-    delta_x = delta_inv_p * L    # ETH数量的变化
-    delta_y = delta_p * L        # USDC数量的变化
-    
+    # 根据流动性和价格平方根的变化计算资产变化
+    # Δx = L * (1/√P1 - 1/√P) = L * (√P - √P1) / (√P * √P1)
+    # Δy = L * (√P1 - √P)
+    delta_x = L * (sp - sp1) / (sp * sp1)   # ETH数量的变化
+    delta_y = L * (sp1 - sp)                # USDC数量的变化
+
     # 计算新的资产余额
     x1 = x + delta_x
     y1 = y + delta_y
     print("delta_x={:.2f} delta_y={:.2f}".format(delta_x, delta_y))
     print("Amount of ETH x={:.2f} amount of USDC y={:.2f}".format(x1, y1))
+    print("")
+
+
+#
+# 示例4：使用与链上相同的整数数学重新计算示例3
+#
+def example_4():
+    """
+    示例4：使用Q64.96整数数学计算示例3中的头寸，并与浮点数的结果比较
+
+    场景与示例3相同。为简单起见，假设两种代币都有18位小数，
+    这样按最小单位计的价格与示例中的价格相同。
+    """
+    print("Example 4: Example 3 computed with the on-chain integer math (Q64.96)")
+    decimals = 10 ** 18
+    p = 2000     # 初始价格
+    a = 1333.33  # 价格下限
+    b = 3000     # 价格上限
+    x = 2        # 初始ETH数量
+    y = 4000     # 初始USDC数量
+    P1 = 2500    # 新的价格
+
+    # 浮点数版本，数量按最小单位计
+    sp = math.sqrt(p)
+    sa = math.sqrt(a)
+    sb = math.sqrt(b)
+    sp1 = math.sqrt(P1)
+    L = get_liquidity(x * decimals, y * decimals, sp, sa, sb)
+    x1, y1 = calculate_xy(L, sp1, sa, sb)
+
+    # 整数版本，价格平方根使用sqrtPriceX96
+    sp_q96 = price_to_sqrt_price_q96(p)
+    sa_q96 = price_to_sqrt_price_q96(a)
+    sb_q96 = price_to_sqrt_price_q96(b)
+    sp1_q96 = price_to_sqrt_price_q96(P1)
+    L_q96 = get_liquidity_q96(x * decimals, y * decimals, sp_q96, sa_q96, sb_q96)
+    x1_q96, y1_q96 = get_amounts_q96(L_q96, sp1_q96, sa_q96, sb_q96)
+
+    print("L: float={:.0f} integer={}".format(L, L_q96))
+    print("Amount of ETH x: float={:.6f} integer={:.6f}".format(x1 / decimals, x1_q96 / decimals))
+    print("Amount of USDC y: float={:.6f} integer={:.6f}".format(y1 / decimals, y1_q96 / decimals))
+    print("")
+
+
+#
+# 示例5：使用tick表示价格范围
+#
+def example_5():
+    """
+    示例5：示例3中的头寸，价格范围取整到tick后，资产余额是多少？
+
+    场景：
+    - 当前价格: 1 ETH = 2000 USDC
+    - 价格范围: 1333.33-3000 USDC/ETH，向下取整到tick间距（60）的倍数
+    - 可用资产: 2 ETH 和 4000 USDC
+
+    链上的价格范围只能以tick表示，因此实际的范围与输入的价格略有不同。
+    之后让价格从范围下方逐步移动到范围上方，计算每个价格下的资产余额。
+    最后计算当前价格下，头寸规模变为原来的2倍、3倍时的资产数量。
+    """
+    print("Example 5: Using the position from Example 3 with its range rounded down to ticks (tick spacing 60)")
+    p = 2000          # 当前价格
+    a = 1333.33       # 价格下限
+    b = 3000          # 价格上限
+    x = 2             # ETH数量
+    y = 4000          # USDC数量
+    tick_spacing = 60
+
+    # 将价格转换为tick：tick = ⌊ln(P) / ln(1.0001)⌋，再向下取整到tick间距的倍数
+    ln_tick_base = 2 * HALF_LN_TICK_BASE
+    tick_lower = math.floor(math.log(a) / ln_tick_base) // tick_spacing * tick_spacing
+    tick_upper = math.floor(math.log(b) / ln_tick_base) // tick_spacing * tick_spacing
+
+    # 计算tick对应的价格平方根
+    sp = math.sqrt(p)
+    sa = tick_to_sqrt_price(tick_lower)
+    sb = tick_to_sqrt_price(tick_upper)
+    print("ticks=[{}, {}], p_a={:.2f}, p_b={:.2f}".format(tick_lower, tick_upper, sa * sa, sb * sb))
+
+    # 计算流动性和实际存入的资产数量：范围变化后，其中一种资产不会全部用完
+    L = get_liquidity(x, y, sp, sa, sb)
+    x0, y0 = calculate_xy(L, sp, sa, sb)
+    print("L={:.2f}, amount of ETH x={:.2f} amount of USDC y={:.2f}".format(L, x0, y0))
+
+    # 价格从范围下方1800个tick处移动到范围上方1800个tick处，每次900个tick，
+    # 其中包括恰好等于价格下限和价格上限的两个价格
+    sp_path = [tick_to_sqrt_price(tick) for tick in range(tick_lower - 1800, tick_upper + 1801, 900)]
+    xs, ys = calculate_xy_path(L, sp_path, sa, sb)
+    for sp1, x1, y1 in zip(sp_path, xs, ys):
+        print("price={:.2f}: amount of ETH x={:.2f} amount of USDC y={:.2f}".format(sp1 * sp1, x1, y1))
+
+    # 验证结果与逐个调用calculate_xy()的结果相同
+    matches = all((x1, y1) == calculate_xy(L, sp1, sa, sb) for sp1, x1, y1 in zip(sp_path, xs, ys))
+    print("Same as calculate_xy() at all {} prices: {}".format(len(sp_path), matches))
+
+    # 在当前价格下，计算头寸规模变为原来的2倍、3倍时的资产数量
+    liquidities = [L, 2 * L, 3 * L]
+    xs = calculate_x_batch(liquidities, sp, sa, sb)
+    ys = calculate_y_batch(liquidities, sp, sa, sb)
+    for Li, x1, y1 in zip(liquidities, xs, ys):
+        print("L={:.2f}: amount of ETH x={:.2f} amount of USDC y={:.2f}".format(Li, x1, y1))
+
+    # 批量计算只改变了运算顺序，结果与逐个调用calculate_x()和calculate_y()的结果只可能有舍入误差
+    matches = all(math.isclose(x1, calculate_x(Li, sp, sa, sb)) and math.isclose(y1, calculate_y(Li, sp, sa, sb))
+                  for Li, x1, y1 in zip(liquidities, xs, ys))
+    print("Same as calculate_x() and calculate_y() for all {} liquidities: {}".format(len(liquidities), matches))
 
 
 def examples():
@@ -500,6 +892,8 @@ def examples():
     example_1()
     example_2()
     example_3()
+    example_4()
+    example_5()
 
 def main():
     """主函数：运行测试和示例"""